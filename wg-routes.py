@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 #
 #  File: wg_routes.py
 #
@@ -28,41 +28,103 @@
 #  USA
 #
 
-from tempfile import NamedTemporaryFile
+import ctypes, ctypes.util
+import functools
 import socket
+import struct
 import re
-import argparse
 import sys, os
-
-try:
-    import subprocess32 as subprocess
-except ImportError:
-    import subprocess
+import errno
+import json
+import time
+import subprocess
 
 __version__ = '0.2'
 
+_COMMANDS = ('up', 'down', 'status')
+
+### parsed config values (with hostnames resolved) and the default gateway
+### are cached in '<config_file>.cache' for this many seconds
+CONF_CACHE_TTL = 300
+GW_CACHE_TTL   = 30
+
+### config variables, and whether each one is resolved via DNS at parse time
+_CONF_VARS = {
+    'WG_CLIENT':        True,
+    'WG_SERVER':        True,
+    'DEFAULT_GW':       True,
+    'ENABLE_PF_POLICY': False,
+    'PF_CONFIG_FILE':   False,
+    'PF_RULES_FILE':    False,
+    'PF_INTF':          False,
+}
+
+### precompiled regexes for config parsing
+_CONF_RE = re.compile(r'\s*(' + '|'.join(_CONF_VARS) + r')\s+(\S+)')
+_PF_WG_SERVER_RE = re.compile(r'^\s*WG_SERVER\s+=\s+\"(\S+)\"')
+
+### routing table constants from <sys/sysctl.h> and <net/route.h> on macOS
+CTL_NET     = 4
+PF_ROUTE    = 17
+NET_RT_DUMP = 1
+
+RTM_VERSION = 5
+RTM_ADD     = 0x1
+RTM_DELETE  = 0x2
+
+RTF_UP      = 0x1
+RTF_GATEWAY = 0x2
+RTF_HOST    = 0x4
+RTF_STATIC  = 0x800
+RTF_IFSCOPE = 0x1000000
+
+RTA_DST     = 0x1
+RTA_GATEWAY = 0x2
+RTA_NETMASK = 0x4
+RTAX_MAX    = 8
+
+### struct rt_msghdr: msglen, version, type, index, flags, addrs, pid, seq,
+### errno, use, inits, and then struct rt_metrics (14 x u_int32_t)
+_RT_MSGHDR = struct.Struct('=HBBH2xiiiiiiI56x')
+
+### rtm_pid, rtm_seq, and rtm_errno from a routing socket reply
+_RTM_REPLY = struct.Struct('=16xiii')
+
+### rtm_errno values expected when routes are already added or removed
+_RTM_ERRORS = {
+    errno.EEXIST: 'route exists',
+    errno.ESRCH:  'not in table',
+}
+
+### struct sockaddr_in: len, family, port, addr, zero padding
+_SOCKADDR_IN = struct.Struct('=BBH4s8x')
+
 def main():
 
     config_file = os.path.expanduser('~/.wg-routes.conf')
     cmd  = ''
     conf = {}
 
-    if len(sys.argv) == 2:
-        cmd = sys.argv[1].lower()
-    elif len(sys.argv) == 3:
-        config_file = sys.argv[2]
-    elif len(sys.argv) == 1:
+    ### usage: wg-routes.py [up|down|status] [config_file], or the --setup,
+    ### --list, and --version switches. Command mode is detected here so that
+    ### it never pays for building the argparse parser.
+    if len(sys.argv) == 1:
         ### equate this with 'status'
         cmd = 'status'
-
-    if cmd and '-' not in cmd:
-        ### command mode, so validate the command and take the next steps
-        if cmd != 'up' and cmd != 'down' and cmd != 'status':
-            raise NameError("<cmd> must be one of up|down|status")
-
+    elif not sys.argv[1].startswith('-'):
+        cmd = sys.argv[1].lower()
+        if cmd not in _COMMANDS:
+            raise SystemExit("<cmd> must be one of up|down|status")
+        if len(sys.argv) > 3:
+            raise SystemExit(f"usage: {os.path.basename(sys.argv[0])} [up|down|status] [config_file]")
+        if len(sys.argv) == 3:
+            config_file = sys.argv[2]
+
+    if cmd:
+        ### command mode, so take the next steps
         if config_file:
             if not os.path.exists(config_file):
-                raise NameError("config file '%s' does not exist" % config_file)
+                raise SystemExit(f"config file '{config_file}' does not exist")
 
         parse_config(conf, config_file)
 
@@ -89,24 +151,24 @@ def main():
     cargs = parse_cmdline()
 
     if cargs.version:
-        print "wg-routes-" + __version__
+        print(f"wg-routes-{__version__}")
         return 0
 
     if not cargs.setup and not cargs.list:
-        raise NameError("Must use one of --setup or --list")
+        raise SystemExit("Must use one of --setup or --list")
 
     if cargs.list:
         display_config(config_file, cargs)
         return 0
 
     if not cargs.wg_server:
-        raise NameError("[*] Specify the Wireguard server IP (or hostname) with --wg-server")
+        raise SystemExit("[*] Specify the Wireguard server IP (or hostname) with --wg-server")
 
     if not cargs.wg_client:
-        raise NameError("[*] Specify the local VM IP/hostname where the Wireguard client is running with --wg-client")
+        raise SystemExit("[*] Specify the local VM IP/hostname where the Wireguard client is running with --wg-client")
 
     if not cargs.wg_port:
-        raise NameError("[*] Specify the Wireguard UDP port number with --wg-port")
+        raise SystemExit("[*] Specify the Wireguard UDP port number with --wg-port")
 
     if cargs.config_file:
         config_file = cargs.config_file
@@ -126,118 +188,216 @@ def main():
         write_config(config_file, pf_config_file, pf_rules_file, cargs)
         write_pf_config(pf_config_file, pf_rules_file, cargs)
         write_pf_rules(pf_rules_file, cargs)
-        print "Configs written to '%s', '%s',\nand '%s'. Now 'up|down|status' cmds can be used." \
-                % (config_file, pf_config_file, pf_rules_file)
+        print(f"Configs written to '{config_file}', '{pf_config_file}',\n"
+                f"and '{pf_rules_file}'. Now 'up|down|status' cmds can be used.")
 
     return 0
 
 def parse_config(conf, config_file):
-    with open(config_file, 'r') as f:
-        for line in f:
-            for var in ['WG_CLIENT',
-                    'WG_SERVER',
-                    'DEFAULT_GW',
-                    'ENABLE_PF_POLICY',
-                    'PF_CONFIG_FILE',
-                    'PF_RULES_FILE',
-                    'PF_INTF']:
-                m = re.search("^\s*%s\s+(\S+)" % var, line)
-                if m:
-                    ### resolve via DNS if necessary at parse time to allow hostnames
-                    ### in the config
-                    if var in ['WG_CLIENT', 'WG_SERVER', 'DEFAULT_GW']:
-                        try:
-                            conf[var] = resolve(m.group(1))
-                        except:
-                            raise NameError("[*] Could not resolve %s '%s' to an IP address." \
-                                    % (var, m.group(1)))
-                    else:
-                        conf[var] = m.group(1)
-                    break
+
+    now   = time.time()
+    mtime = os.stat(config_file).st_mtime
+    cache = read_conf_cache(config_file)
+    cache_updated = False
+
+    if cache.get('mtime') == mtime and 'conf' in cache \
+            and 0 <= now - cache.get('conf_time', 0) < CONF_CACHE_TTL:
+        ### the config has not changed since it was last parsed, so skip
+        ### re-reading it and re-resolving any hostnames
+        conf.update(cache['conf'])
+    else:
+        with open(config_file, 'r') as f:
+            for line in f:
+                m = _CONF_RE.match(line)
+                if not m:
+                    continue
+                (var, val) = m.groups()
+                ### resolve via DNS if necessary at parse time to allow hostnames
+                ### in the config
+                if _CONF_VARS[var]:
+                    try:
+                        conf[var] = resolve(val)
+                    except (SystemExit, OSError, UnicodeError):
+                        raise SystemExit(
+                                f"[*] Could not resolve {var} '{val}' to an IP address.")
+                else:
+                    conf[var] = val
+        cache['mtime']     = mtime
+        cache['conf_time'] = now
+        cache['conf']      = dict(conf)
+        cache_updated = True
+
     if 'DEFAULT_GW' not in conf or 'PF_INTF' not in conf:
-        gw, intf = get_default_gw()
+        if 'gw' in cache and 0 <= now - cache.get('gw_time', 0) < GW_CACHE_TTL:
+            gw, intf = cache['gw']
+        else:
+            gw, intf = get_default_gw()
+            cache['gw_time'] = now
+            cache['gw']      = [gw, intf]
+            cache_updated = True
         if 'DEFAULT_GW' not in conf:
             conf['DEFAULT_GW'] = gw
         if 'PF_INTF' not in conf:
             conf['PF_INTF'] = gw
+
+    if cache_updated:
+        write_conf_cache(config_file, cache)
+    return
+
+def read_conf_cache(config_file):
+    try:
+        with open(config_file + '.cache', 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    ### anything not shaped like a cache written by write_conf_cache() is a
+    ### miss - the cached values end up in route updates and 'pfctl -f'
+    if not isinstance(cache, dict):
+        return {}
+    for key in ('mtime', 'conf_time', 'gw_time'):
+        if not isinstance(cache.get(key, 0), (int, float)):
+            return {}
+    conf = cache.get('conf', {})
+    if not isinstance(conf, dict) \
+            or not all(isinstance(v, str) for v in conf.values()):
+        return {}
+    gw = cache.get('gw', ['', ''])
+    if not isinstance(gw, list) or len(gw) != 2 \
+            or not all(isinstance(v, str) for v in gw):
+        return {}
+    return cache
+
+def write_conf_cache(config_file, cache):
+    ### write to a temp file and rename it over the cache so a concurrent
+    ### invocation never reads a partially written cache
+    from tempfile import mkstemp
+
+    cache_file = config_file + '.cache'
+    try:
+        (fd, tmp_file) = mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)))
+    except OSError:
+        ### caching is only an optimization
+        return
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f)
+        os.rename(tmp_file, cache_file)
+    except OSError:
+        pass
+    finally:
+        ### don't leave the temp file behind if it was not renamed
+        try:
+            os.unlink(tmp_file)
+        except OSError:
+            pass
+    return
+
+def clear_conf_cache(config_file):
+    try:
+        os.unlink(config_file + '.cache')
+    except OSError:
+        pass
     return
 
 def pf_validate_server_ip(conf, config_file):
     with open(conf['PF_RULES_FILE'], 'r') as f:
         for line in f:
-            m = re.search('^\s*WG_SERVER\s+=\s+\"(\S+)\"', line)
+            m = _PF_WG_SERVER_RE.search(line)
             if m:
                 if m.group(1) != conf['WG_SERVER']:
-                    raise NameError("[*] WG_SERVER not equal between configs '%s' and '%s'" \
-                            % (conf['PF_RULES_FILE'], config_file))
+                    raise SystemExit("[*] WG_SERVER not equal between configs "
+                            f"'{conf['PF_RULES_FILE']}' and '{config_file}'")
                 break
     return
 
 def display_config(config_file, cargs):
-    print "\nDisplaying config: '%s'\n\n" % config_file
+    print(f"\nDisplaying config: '{config_file}'\n\n")
     with open(config_file, 'r') as f:
         for line in f:
-            print line.rstrip()
-    print
+            print(line.rstrip())
+    print()
     return
 
 def write_config(config_file, pf_config_file, pf_rules_file, cargs):
 
-    def_gw = "# DEFAULT_GW        NA"
-    if cargs.default_gw:
-        def_gw = "DEFAULT_GW          %s" % cargs.default_gw
-
-    enable_pf = "ENABLE_PF_POLICY    Y"
+    enable_pf = 'Y'
     if cargs.disable_pf_policy:
-        enable_pf = "ENABLE_PF_POLICY    N"
+        enable_pf = 'N'
 
-    pf_intf = "# PF_INTF           NA"
+    pf_intf = False
     if cargs.default_gw:
-        pf_intf = "PF_INTF          %s" % cargs.pf_interface
+        pf_intf = cargs.pf_interface
+
+    ### previously parsed values are stale once the config is rewritten
+    clear_conf_cache(config_file)
+
+    ### build the whole config up front and write it with (normally) a single
+    ### syscall, the file is only readable by its owner
+    body = config_text(cargs.wg_client, cargs.wg_server, cargs.default_gw,
+            enable_pf, pf_config_file, pf_rules_file, pf_intf).encode()
+    fd = os.open(config_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        ### the O_CREAT mode only applies to new files
+        os.fchmod(fd, 0o600)
+        written = 0
+        while written < len(body):
+            written += os.write(fd, body[written:])
+    finally:
+        os.close(fd)
 
-    with open(config_file, 'w') as f:
-        f.write('''#
-# Configuration file for the '%s' utility
+    return
+
+def config_text(wg_client, wg_server, default_gw, enable_pf, pf_config_file,
+        pf_rules_file, pf_intf):
+
+    def_gw_line = "# DEFAULT_GW        NA"
+    if default_gw:
+        def_gw_line = f"DEFAULT_GW          {default_gw}"
+
+    pf_intf_line = "# PF_INTF           NA"
+    if pf_intf:
+        pf_intf_line = f"PF_INTF          {pf_intf}"
+
+    return f'''#
+# Configuration file for the '{__file__}' utility
 #
 
 # The WG_CLIENT IP is usually a local VM running Wireguard
-WG_CLIENT           %s
+WG_CLIENT           {wg_client}
 
 # The WG_SERVER IP is the remote Internet-connected system running Wireguard.
 # All traffic will be routed through this system.
-WG_SERVER           %s
+WG_SERVER           {wg_server}
 
 # Normally the default gateway is parsed from the local routing table and
 # therefore does not need to be set here. It is only set if the --default-gw
 # command line switch is used.
-%s
+{def_gw_line}
 
 # Control whether to add a default-drop PF policy for everything except
 # Wireguard communications and DHCP traffic. The default is for this feature
 # to be enabled, but this can be changed with the --disable-pf-policy command
 # line argument. Also set the paths to the PF config and rules files.
-%s
-PF_CONFIG_FILE      %s
-PF_RULES_FILE       %s
+ENABLE_PF_POLICY    {enable_pf}
+PF_CONFIG_FILE      {pf_config_file}
+PF_RULES_FILE       {pf_rules_file}
 
 # Normally the interface to which PF rules are restricted is parsed from the
 # default gateway route. However, it can be set manually with --pf-interface
 # if necessary
-%s
-''' % (__file__, cargs.wg_client, cargs.wg_server, def_gw, enable_pf,
-    pf_config_file, pf_rules_file, pf_intf))
-
-    return
+{pf_intf_line}
+'''
 
 def write_pf_config(pf_config_file, pf_rules_file, cargs):
 
     with open(pf_config_file, 'w') as f:
-        f.write('''#
-# This file is auto-generated by the '%s' tool, and sets up a PF policy
+        f.write(f'''#
+# This file is auto-generated by the '{__file__}' tool, and sets up a PF policy
 # that restricts communications to go over Wireguard.
 anchor "wg-pf.rules"
-load anchor "wg-pf.rules" from "%s"
-''' % (__file__, pf_rules_file))
+load anchor "wg-pf.rules" from "{pf_rules_file}"
+''')
 
     return
 
@@ -249,12 +409,12 @@ def write_pf_rules(pf_rules_file, cargs):
         intf = get_default_gw()[1]
 
     with open(pf_rules_file, 'w') as f:
-        f.write('''#
-# This file is auto-generated by the '%s' tool, and sets up a PF policy
+        f.write(f'''#
+# This file is auto-generated by the '{__file__}' tool, and sets up a PF policy
 # that restricts communications to go over Wireguard.
-WG_SERVER = "%s"
-WG_PORT = "%s"
-INTF = "%s"
+WG_SERVER = "{cargs.wg_server}"
+WG_PORT = "{cargs.wg_port}"
+INTF = "{intf}"
 
 block in log on $INTF all
 block out log on $INTF all
@@ -266,14 +426,14 @@ pass quick on $INTF inet proto udp from any port 67:68 to any port 67:68 keep st
 # Restrict everything to Wireguard communications
 pass out quick on $INTF inet proto udp from any to $WG_SERVER port $WG_PORT keep state
 
-''' % (__file__, cargs.wg_server, cargs.wg_port, intf))
+''')
 
     return
 
 def up_guidance(wg_client):
-    print '''
+    print(f'''
 With routing configured to send traffic to the Wireguard client system
-'%s', it is usually necessary to add NAT rule in iptables along with
+'{wg_client}', it is usually necessary to add NAT rule in iptables along with
 allowing IP forwarding. The NAT rule should translate incoming IP traffic
 from the Mac to the Wireguard client IP assigned in the 'Address' line in
 the Wireguard interface configuration file. The incoming traffic from the
@@ -283,21 +443,21 @@ E.g.:
 [wgclientvm]# iptables -t nat -A POSTROUTING -s <vnic0_IP> -j SNAT --to <WG_client_IP>
 
 [wgclientvm]# echo 1 > /proc/sys/net/ipv4/ip_forward
-''' % wg_client
+''')
     return
 
 def down_guidance(wg_client):
-    print '''
+    print(f'''
 Applicable routes and PF rules have been removed. The corresponding NAT rule and
-IP forwarding configuration can (optionally) be removed from the '%s'
+IP forwarding configuration can (optionally) be removed from the '{wg_client}'
 Wireguard client system.
-''' % wg_client
+''')
     return
 
 def pf_update(cmd, conf, config_file):
 
     if conf['ENABLE_PF_POLICY'] != 'Y':
-        print "PF policy disabled in config file '%s', no action taken." % config_file
+        print(f"PF policy disabled in config file '{config_file}', no action taken.")
         return
 
     if cmd == 'up':
@@ -305,13 +465,13 @@ def pf_update(cmd, conf, config_file):
         ### variable in the PF rules file matches the same IP in the main config file
         pf_validate_server_ip(conf, config_file)
         pf_test_rules(conf)
-        pfcmd = "pfctl -f %s" % conf['PF_CONFIG_FILE']
-        print "Implementing default-drop PF policy via command: '%s'" % pfcmd
+        pfcmd = ['pfctl', '-f', conf['PF_CONFIG_FILE']]
+        print(f"Implementing default-drop PF policy via command: '{' '.join(pfcmd)}'")
         run_cmd(pfcmd)
     else:
         ### restore original PF rules
-        pfcmd = "pfctl -f /etc/pf.conf"
-        print "Restoring original PF rules via command: '%s'" % pfcmd
+        pfcmd = ['pfctl', '-f', '/etc/pf.conf']
+        print(f"Restoring original PF rules via command: '{' '.join(pfcmd)}'")
         run_cmd(pfcmd)
 
     return
@@ -319,38 +479,40 @@ def pf_update(cmd, conf, config_file):
 def pf_status(conf):
 
     if conf['ENABLE_PF_POLICY'] != 'Y':
-        print "PF policy disabled in config file '%s', no available status." % config_file
+        print(f"PF policy disabled in config file '{config_file}', no available status.")
         return
 
     ### first see if the wg-pf.rules anchor is active
     found_wg_anchor = False
 
     wg_anchor = 'wg-pf.rules'
-    (es, out) = run_cmd("pfctl -sr")
+    wg_anchor_bytes = wg_anchor.encode()
+    (es, out) = run_cmd(['pfctl', '-sr'])
     if es == 0:
-        for line in out:
-            if 'anchor' in line and wg_anchor in line:
+        for line in out.splitlines():
+            if b'anchor' in line and wg_anchor_bytes in line:
                 found_wg_anchor = True
                 break
 
     if found_wg_anchor:
-        (es, out) = run_cmd("pfctl -a %s -sr" % wg_anchor)
+        (es, out) = run_cmd(['pfctl', '-a', wg_anchor, '-sr'])
 
         if es == 0:
-            for line in out:
-                if 'block' in line or 'pass' in line:
-                    print "Wireguard PF '%s' anchor rule active: '%s'" % (wg_anchor, line)
+            for line in out.splitlines():
+                if b'block' in line or b'pass' in line:
+                    print(f"Wireguard PF '{wg_anchor}' anchor rule active: "
+                            f"'{line.decode(errors='replace')}'")
     else:
-        print "No active Wireguard PF anchor '%s'" % wg_anchor
+        print(f"No active Wireguard PF anchor '{wg_anchor}'")
     return
 
 def pf_test_rules(conf):
-    cmd = "pfctl -n -f %s" % conf['PF_CONFIG_FILE']
+    cmd = ['pfctl', '-n', '-f', conf['PF_CONFIG_FILE']]
     (es, out) = run_cmd(cmd)
     if es != 0:
-        print "[*] pf_test_rules() error, CMD: %s" % cmd
-        for line in out:
-            print line
+        print(f"[*] pf_test_rules() error, CMD: {' '.join(cmd)}")
+        if out:
+            print(out.decode(errors='replace').rstrip('\n'))
     return
 
 def route_status(conf):
@@ -359,32 +521,36 @@ def route_status(conf):
     ### 128.0/1            10.111.55.31       UGSc            1        0   vnic0
     ### 2.2.2.2            192.168.0.1        UGHS            1       88     en
 
-    netstat_cmd = 'netstat -rn'
+    ### (dst, netmask, gateway) -> route name, so each routing table entry is
+    ### classified with a single dict lookup
+    wg_routes = {
+        ('0.0.0.0', '128.0.0.0', conf['WG_CLIENT']):                 'h1',
+        ('128.0.0.0', '128.0.0.0', conf['WG_CLIENT']):               'h2',
+        (conf['WG_SERVER'], '255.255.255.255', conf['DEFAULT_GW']):  'gw',
+    }
 
-    found_h1 = False
-    found_h2 = False
-    found_gw = False
-    for line in run_cmd(netstat_cmd)[1]:
-        if re.search("^\s*0\/1\s+%s\s" % conf['WG_CLIENT'], line):
-            found_h1 = line.rstrip()
-        elif re.search("^\s*128\.0\/1\s+%s\s" % conf['WG_CLIENT'], line):
-            found_h2 = line.rstrip()
-        elif re.search("^\s*%s\s+%s\s" % (conf['WG_SERVER'], conf['DEFAULT_GW']), line):
-            found_gw = line.rstrip()
+    found = {}
+    for route in _get_routes():
+        name = wg_routes.get(route[:3])
+        if name:
+            found[name] = _route_str(route)
+
+    found_h1 = found.get('h1')
+    found_h2 = found.get('h2')
+    found_gw = found.get('gw')
 
     if found_h1:
-        print "Wireguard client route active: '%s'" % found_h1
+        print(f"Wireguard client route active: '{found_h1}'")
     else:
-        print "No Wireguard client route '0/1 -> %s'" % conf['WG_CLIENT']
+        print(f"No Wireguard client route '0/1 -> {conf['WG_CLIENT']}'")
     if found_h2:
-        print "Wireguard client route active: '%s'" % found_h2
+        print(f"Wireguard client route active: '{found_h2}'")
     else:
-        print "No Wireguard client route '128.0/1 -> %s'" % conf['WG_CLIENT']
+        print(f"No Wireguard client route '128.0/1 -> {conf['WG_CLIENT']}'")
     if found_gw:
-        print "Wireguard server route active: '%s'" % found_gw
+        print(f"Wireguard server route active: '{found_gw}'")
     else:
-        print "No Wireguard server route '%s -> %s'" % (conf['WG_SERVER'],
-                conf['DEFAULT_GW'])
+        print(f"No Wireguard server route '{conf['WG_SERVER']} -> {conf['DEFAULT_GW']}'")
     return
 
 def route_update(rcmd, conf):
@@ -398,116 +564,249 @@ def route_update(rcmd, conf):
     ### route add 2.2.2.2 192.168.0.1
 
     update_cmd = 'add'
+    rtm_type   = RTM_ADD
     if rcmd == 'down':
         update_cmd = 'delete'
-
-    print
-    for cmd in ["route %s 0.0.0.0/1 %s" % (update_cmd, conf['WG_CLIENT']),
-            "route %s 128.0.0.0/1 %s" % (update_cmd, conf['WG_CLIENT']),
-            "route %s %s %s" % (update_cmd, conf['WG_SERVER'], conf['DEFAULT_GW'])
-        ]:
-        print "Running cmd: '%s'" % cmd
-        (es, out) = run_cmd(cmd)
-
-        ### look for indications of errors not caught by the process
-        ### exit status
-        found_err = False
-        if rcmd == 'up':
-            ### # route add 0.0.0.0/1 10.111.55.31
-            ### route: writing to routing socket: File exists
-            ### add net 0.0.0.0: gateway 10.111.55.31: File exists
-            for line in out:
-                if 'File exists' in line:
-                    found_err = True
-                    break
-        elif rcmd == 'down':
-            for line in out:
-                ### # route delete 0.0.0.0/1 10.111.55.31
-                ### route: writing to routing socket: not in table
-                ### delete net 0.0.0.0: gateway 10.111.55.31: not in table
-                if 'not in table' in line:
-                    found_err = True
-                    break
-        if found_err:
-            for line in out:
-                print line
+        rtm_type   = RTM_DELETE
+
+    routes = (('0.0.0.0', '128.0.0.0', conf['WG_CLIENT']),
+            ('128.0.0.0', '128.0.0.0', conf['WG_CLIENT']),
+            (conf['WG_SERVER'], None, conf['DEFAULT_GW']))
+
+    ### build all of the routing messages up front so they can be written
+    ### back-to-back, rtm_seq is the index into 'routes' plus one
+    pid = os.getpid()
+    messages = tuple(_build_rtmsg(rtm_type, pid, seq, dst, mask, gw)
+            for (seq, (dst, mask, gw)) in enumerate(routes, 1))
+
+    print()
+    for (dst, mask, gw) in routes:
+        if mask:
+            print(f"Updating route: 'route {update_cmd} {dst}/1 {gw}'")
+        else:
+            print(f"Updating route: 'route {update_cmd} {dst} {gw}'")
+
+    ### write the route updates directly to a routing socket instead of
+    ### running the 'route' binary for each one
+    rtm_errnos = [0] * len(messages)
+    with socket.socket(socket.AF_ROUTE, socket.SOCK_RAW, 0) as s:
+        s.settimeout(2)
+
+        for (i, msg) in enumerate(messages):
+            try:
+                s.send(msg)
+            except OSError as e:
+                rtm_errnos[i] = e.errno
+
+        ### the kernel echoes each message back with rtm_errno set, but other
+        ### routing messages (e.g. RTM_IFINFO or RTM_NEWADDR, which use other
+        ### header layouts) can arrive on the socket as well
+        replies = 0
+        while replies < len(messages):
+            try:
+                reply = s.recv(2048)
+            except OSError:
+                ### timed out or e.g. ENOBUFS - routes without a reply keep
+                ### the result of their send()
+                break
+            if len(reply) < _RT_MSGHDR.size or reply[2] != RTM_VERSION \
+                    or reply[3] != rtm_type:
+                continue
+            (rtm_pid, rtm_seq, rtm_errno) = _RTM_REPLY.unpack_from(reply)
+            if rtm_pid == pid and 0 < rtm_seq <= len(messages):
+                rtm_errnos[rtm_seq-1] = rtm_errno
+                replies += 1
+
+    for ((dst, mask, gw), rtm_errno) in zip(routes, rtm_errnos):
+        if not rtm_errno:
+            continue
+        ### e.g. 'route: add net 0.0.0.0: gateway 10.111.55.31: route exists'
+        route_type = 'net'
+        if not mask:
+            route_type = 'host'
+        err_str = _RTM_ERRORS.get(rtm_errno) or os.strerror(rtm_errno)
+        print(f"route: {update_cmd} {route_type} {dst}: gateway {gw}: {err_str}")
 
     return
 
+def _build_rtmsg(rtm_type, pid, seq, dst, mask, gw):
+
+    ### an rt_msghdr followed by the destination, gateway, and (for network
+    ### routes) netmask sockaddr_in structs
+    flags = RTF_UP | RTF_GATEWAY | RTF_STATIC
+    addrs = RTA_DST | RTA_GATEWAY
+    body  = _SOCKADDR_IN.pack(_SOCKADDR_IN.size, socket.AF_INET, 0,
+                socket.inet_aton(dst)) \
+            + _SOCKADDR_IN.pack(_SOCKADDR_IN.size, socket.AF_INET, 0,
+                socket.inet_aton(gw))
+    if mask:
+        addrs |= RTA_NETMASK
+        body  += _SOCKADDR_IN.pack(_SOCKADDR_IN.size, socket.AF_INET, 0,
+                socket.inet_aton(mask))
+    else:
+        flags |= RTF_HOST
+
+    return _RT_MSGHDR.pack(_RT_MSGHDR.size + len(body), RTM_VERSION, rtm_type,
+            0, flags, addrs, pid, seq, 0, 0, 0) + body
+
 def resolve(host):
     ip = ''
     if ':' in host:
-        raise NameError("[*] IPv6 coming soon....")
+        raise SystemExit("[*] IPv6 coming soon....")
     else:
-        if re.search('(?:[0-2]?\d{1,2}\.){3}[0-2]?\d{1,2}', host):
+        try:
+            ### already an IPv4 address, so no DNS lookup is needed
+            socket.inet_pton(socket.AF_INET, host)
             ip = host
-        else:
-            ### it's a hostname, so resolve
-            ip = socket.gethostbyname(host)
-            if not ip or not re.search('(?:[0-2]?\d{1,2}\.){3}[0-2]?\d{1,2}', ip):
-                raise NameError("[*] Could not resolve '%s' to an IP" % ip)
+        except OSError:
+            ### it's a hostname, so resolve. A single socket type yields one
+            ### result per address, and AI_ADDRCONFIG skips lookups for
+            ### address families that aren't configured locally
+            infos = socket.getaddrinfo(host, None, socket.AF_INET,
+                    socket.SOCK_DGRAM, 0,
+                    socket.AI_ADDRCONFIG | socket.AI_NUMERICSERV)
+            ip = infos[0][4][0]
     return ip
 
 def get_default_gw():
 
     gw    = ''
-    flags = ''
+    flags = 0
     intf  = ''
-    netstat_cmd = 'netstat -rn'
 
-    ### parse 'netstat -rn' output on macOS to get the default (IPv4) gw
+    ### find the default (IPv4) gw in the kernel routing table, this is the
+    ### same route that 'netstat -rn' displays as:
     ### Destination        Gateway            Flags        Refs      Use   Netif Expire
     ### default            192.168.0.1        UGSc           69        0     en0
 
-    for line in run_cmd(netstat_cmd)[1]:
-        if 'default' in line:
-            m = re.search('default\s+((?:[0-2]?\d{1,2}\.){3}[0-2]?\d{1,2})\s+(\w+)\s+(?:\S+\s+){2}(\S+)', line)
-            if m:
-                gw    = m.group(1)
-                flags = m.group(2)
-                intf  = m.group(3)
-                break
-            else:
-                m = re.search('default\s+((?:[0-2]?\d{1,2}\.){3}[0-2]?\d{1,2})\s+(\w+)\s+(\S+)', line)
-                if m:
-                    gw    = m.group(1)
-                    flags = m.group(2)
-                    intf  = m.group(3)
-                    break
-
-    if gw and flags:
-        for flag in ['G', 'U']:
-            if flag not in flags:
-                raise NameError(
-                    "[*] Default gateway '%s' does not have the '%s' flag, set --default-gw and --pf-interface" \
-                            % (gw, flag))
+    for (dst, mask, gateway, rt_flags, rt_intf) in _get_routes():
+        ### interface-scoped default routes ('I' flag) are not the primary one
+        if dst == '0.0.0.0' and mask == '0.0.0.0' and gateway \
+                and not rt_flags & RTF_IFSCOPE:
+            gw    = gateway
+            flags = rt_flags
+            intf  = rt_intf
+            break
+
+    if gw:
+        for (flag, flag_str) in [(RTF_GATEWAY, 'G'), (RTF_UP, 'U')]:
+            if not flags & flag:
+                raise SystemExit(
+                    f"[*] Default gateway '{gw}' does not have the '{flag_str}' flag, set --default-gw and --pf-interface")
     else:
-        raise NameError(
-            "[*] Could not parse default gateway from '%s' output, set --default-gw and --pf-interface" \
-                    % netstat_cmd)
+        raise SystemExit(
+            "[*] Could not find default gateway in the routing table, set --default-gw and --pf-interface")
 
     return gw, intf
 
+@functools.lru_cache(maxsize=1)
+def _get_routes():
+
+    ### dump the IPv4 routing table with a single sysctl() call instead of
+    ### running 'netstat -rn' - returns a tuple of
+    ### (dst, netmask, gateway, flags, interface) tuples. The result is
+    ### memoized so get_default_gw() and route_status() share one dump per
+    ### invocation.
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    ### declare the prototype so 'newlen' is passed as a full size_t
+    libc.sysctl.argtypes = (ctypes.POINTER(ctypes.c_int), ctypes.c_uint,
+            ctypes.c_void_p, ctypes.POINTER(ctypes.c_size_t), ctypes.c_void_p,
+            ctypes.c_size_t)
+    mib  = (ctypes.c_int * 6)(CTL_NET, PF_ROUTE, 0, socket.AF_INET, NET_RT_DUMP, 0)
+    size = ctypes.c_size_t(0)
+
+    if libc.sysctl(mib, 6, None, ctypes.byref(size), None, 0) != 0:
+        raise SystemExit("[*] Could not size the routing table via sysctl(): "
+                f"{os.strerror(ctypes.get_errno())}")
+    buf = ctypes.create_string_buffer(size.value)
+    if libc.sysctl(mib, 6, buf, ctypes.byref(size), None, 0) != 0:
+        raise SystemExit("[*] Could not dump the routing table via sysctl(): "
+                f"{os.strerror(ctypes.get_errno())}")
+
+    return tuple((dst, mask, gw, flags, _if_name(index))
+            for (dst, mask, gw, flags, index) in _parse_rt_dump(buf.raw[:size.value]))
+
+def _parse_rt_dump(data):
+
+    ### walk a NET_RT_DUMP buffer - returns a list of
+    ### (dst, netmask, gateway, flags, interface index) tuples
+    routes = []
+    offset = 0
+    while offset + _RT_MSGHDR.size <= len(data):
+        (msglen, version, rtm_type, index, flags, addrs, pid, seq, rtm_errno,
+                use, inits) = _RT_MSGHDR.unpack_from(data, offset)
+        if not msglen:
+            break
+
+        ### the sockaddrs follow the header in RTAX_* order, one for each bit
+        ### set in rtm_addrs, with lengths rounded up to 32-bit boundaries
+        sa = {}
+        sa_off = offset + _RT_MSGHDR.size
+        for i in range(RTAX_MAX):
+            if not addrs & (1 << i):
+                continue
+            (sa_len, sa_family) = struct.unpack_from('BB', data, sa_off)
+            sa[1 << i] = (sa_family, _sockaddr_ip(data, sa_off, sa_len))
+            sa_off += 1 + ((sa_len - 1) | 3) if sa_len else 4
+
+        dst = sa.get(RTA_DST)
+        gw  = sa.get(RTA_GATEWAY)
+        if dst and dst[0] == socket.AF_INET:
+            if RTA_NETMASK in sa:
+                mask = sa[RTA_NETMASK][1]
+            elif flags & RTF_HOST:
+                mask = '255.255.255.255'
+            else:
+                mask = None
+            gw_ip = None
+            if gw and gw[0] == socket.AF_INET:
+                gw_ip = gw[1]
+            routes.append((dst[1], mask, gw_ip, flags, index))
+
+        offset += msglen
+
+    return routes
+
+def _sockaddr_ip(data, offset, sa_len):
+    ### struct sockaddr_in: len, family, port, addr - netmasks in a routing
+    ### table dump are truncated after the last non-zero byte
+    addr = data[offset+4:offset+max(4, min(sa_len, 8))]
+    return socket.inet_ntoa(addr + b'\0' * (4 - len(addr)))
+
+def _if_name(index):
+    try:
+        return socket.if_indextoname(index)
+    except OSError:
+        return ''
+
+def _route_str(route):
+    (dst, mask, gw, flags, intf) = route
+    prefix = 32
+    if mask:
+        prefix = sum(bin(b).count('1') for b in struct.unpack('4B', socket.inet_aton(mask)))
+    return f"{dst}/{prefix} -> {gw} {intf}"
+
 def run_cmd(cmd):
-    out = []
 
-    fh = NamedTemporaryFile(delete=False)
-    es = subprocess.call(cmd, stdin=None,
-            stdout=fh, stderr=subprocess.STDOUT, shell=True)
-    fh.close()
-    with open(fh.name, 'r') as f:
-        for line in f:
-            out.append(line.rstrip('\n'))
-    os.unlink(fh.name)
+    ### 'cmd' is an argv list that is executed directly without a shell, and
+    ### stdout and stderr are collected in memory. The output is returned as
+    ### raw bytes, callers split it into lines as needed.
+    p = subprocess.Popen(cmd, stdin=None, shell=False,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    (out, stderr) = p.communicate()
+    es = p.returncode
 
     if (es != 0):
-        print "[-] Non-zero exit status '%d' for CMD: '%s'" % (es, cmd)
-        for line in out:
-            print line
+        print(f"[-] Non-zero exit status '{es}' for CMD: '{' '.join(cmd)}'")
+        if out:
+            print(out.decode(errors='replace').rstrip('\n'))
 
     return es, out
 
 def parse_cmdline():
+    ### imported here since up|down|status command mode never needs it
+    import argparse
+
     p = argparse.ArgumentParser()
 
     p.add_argument("--wg-server", type=str,